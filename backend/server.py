@@ -1,15 +1,23 @@
 """
 FastAPI Server for Semantic Video Search
-Endpoints: /index (POST), /search (GET), /health (GET)
+Endpoints: /index (POST), /search (GET), /search_batch (POST), /health (GET)
 """
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
-from typing import Optional
 import os
-import shutil
+# Keep numpy's BLAS single-threaded so it doesn't oversubscribe cores with FAISS's OpenMP pool;
+# must be set before numpy is first imported
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, Response
+from pydantic import BaseModel, Field
+from typing import List, Optional
+import asyncio
+import hashlib
+import aiofiles
+import threading
+from cachetools import LRUCache
 from video_search import VideoSearchEngine
 
 app = FastAPI(title="Semantic Video Search API")
@@ -26,18 +34,98 @@ app.add_middleware(
 # Global engine instance
 engine = VideoSearchEngine()
 VIDEO_DIR = "uploads"
-FRAMES_DIR = "frames"
 INDEX_PATH = "video_index"
+UPLOAD_CHUNK = 1 << 20  # 1 MiB
+MAX_BATCH_QUERIES = 1024  # per /search_batch request
+MAX_TOP_K = 1024  # GPU FAISS indexes reject k > 2048
+SEARCH_BATCH_SIZE = 32
+SEARCH_BATCH_WAIT = 0.005  # seconds to wait for more queries to join a batch
 
 os.makedirs(VIDEO_DIR, exist_ok=True)
-os.makedirs(FRAMES_DIR, exist_ok=True)
+
+# Decoded preview JPEGs keyed by (video, timestamp), so UI scrubbing doesn't re-decode
+frame_cache = LRUCache(maxsize=256)
+frame_cache_lock = threading.Lock()
+
+
+def clear_frame_cache():
+    with frame_cache_lock:
+        frame_cache.clear()
+
+# filename -> blake2b of its uploaded content, and the (hash, fps, dedupe) the current index was built from
+upload_hashes = {}
+indexed_source = None
+
+
+@app.on_event("startup")
+def warmup():
+    # Pay model/CUDA init cost at startup instead of on the first search
+    engine.warmup()
+
+
+search_queue: asyncio.Queue = None
 
 
+@app.on_event("startup")
+async def start_search_batcher():
+    global search_queue
+    search_queue = asyncio.Queue()
+    app.state.search_batcher = asyncio.create_task(search_batcher())
+
+
+async def search_batcher():
+    """Coalesce concurrent /search calls into one batched encode + FAISS search"""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await search_queue.get()]
+        deadline = loop.time() + SEARCH_BATCH_WAIT
+        while len(batch) < SEARCH_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(search_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        
+        # search_batch takes a single nprobe, so each nprobe value runs as its own batch
+        groups = {}
+        for item in batch:
+            groups.setdefault(item[2], []).append(item)
+        for nprobe, items in groups.items():
+            await run_search_batch(items, nprobe)
+
+
+async def run_search_batch(items: list, nprobe: Optional[int]):
+    queries = [query for query, _, _, _ in items]
+    top_k = max(k for _, k, _, _ in items)
+    try:
+        results = await asyncio.to_thread(engine.search_batch, queries, top_k, nprobe)
+    except Exception as e:
+        if len(items) > 1:
+            # Retry one by one so a single bad request doesn't fail the ones it was batched with
+            for item in items:
+                await run_search_batch([item], nprobe)
+            return
+        for _, _, _, future in items:
+            if not future.done():
+                future.set_exception(e)
+        return
+    for (_, k, _, future), result in zip(items, results):
+        if not future.done():
+            future.set_result(result[:k])
+
 class SearchRequest(BaseModel):
     query: str
     top_k: Optional[int] = 5
 
 
+class SearchBatchRequest(BaseModel):
+    queries: List[str] = Field(..., max_length=MAX_BATCH_QUERIES)
+    top_k: int = Field(5, ge=1, le=MAX_TOP_K)
+    nprobe: Optional[int] = Field(None, ge=1)
+
+
 class IndexRequest(BaseModel):
     fps: Optional[int] = 1
 
@@ -53,27 +141,55 @@ async def upload_video(file: UploadFile = File(...)):
     if not file.filename.endswith(('.mp4', '.avi', '.mov', '.mkv')):
         raise HTTPException(400, "Invalid video format")
     
+    global indexed_source
     path = os.path.join(VIDEO_DIR, file.filename)
-    with open(path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+    # Forget the old content's hash first, so a failed upload can't leave a stale match behind
+    upload_hashes.pop(file.filename, None)
+    if engine.video_path == path:
+        # The index's source file is being replaced; its previews and dedupe key no longer hold
+        indexed_source = None
+        clear_frame_cache()
+    # Stream in chunks so large uploads don't block the event loop
+    digest = hashlib.blake2b()
+    async with aiofiles.open(path, "wb") as f:
+        while chunk := await file.read(UPLOAD_CHUNK):
+            digest.update(chunk)
+            await f.write(chunk)
+    upload_hashes[file.filename] = digest.hexdigest()
     
-    return {"filename": file.filename, "path": path}
+    return {"filename": file.filename, "path": path, "hash": upload_hashes[file.filename]}
 
 
 @app.post("/index")
-async def index_video(filename: str, fps: int = 1):
+async def index_video(filename: str, fps: int = 1, dedupe: bool = True):
     """Index a video file for search"""
+    global indexed_source
     video_path = os.path.join(VIDEO_DIR, filename)
     
     if not os.path.exists(video_path):
         raise HTTPException(404, f"Video not found: {filename}")
     
+    # Same content with the same settings is already indexed
+    source = (upload_hashes.get(filename), fps, dedupe)
+    if source[0] is not None and source == indexed_source and engine.index is not None:
+        # Report the file the index was actually built from (may be a same-content upload under another name)
+        return {
+            "status": "already_indexed",
+            "frames": len(engine.ts_ms),
+            "video": os.path.basename(engine.video_path)
+        }
+    
     try:
-        engine.build_index(video_path, output_dir=FRAMES_DIR, fps=fps)
+        try:
+            engine.build_index(video_path, fps=fps, dedupe=dedupe)
+        finally:
+            # The file behind a cached (path, timestamp) key may have new content
+            clear_frame_cache()
         engine.save(INDEX_PATH)
+        indexed_source = source
         return {
             "status": "indexed",
-            "frames": len(engine.frame_data),
+            "frames": len(engine.ts_ms),
             "video": filename
         }
     except Exception as e:
@@ -81,29 +197,70 @@ async def index_video(filename: str, fps: int = 1):
 
 
 @app.get("/search")
-def search(query: str, top_k: int = 5):
-    """Search indexed video with natural language"""
+async def search(
+    query: str, top_k: int = Query(5, ge=1, le=MAX_TOP_K), nprobe: Optional[int] = Query(None, ge=1)
+):
+    """Search indexed video with natural language
+    
+    nprobe trades recall for latency on IVF indexes (ignored for flat indexes).
+    """
     if engine.index is None:
         # Try loading saved index
         try:
-            engine.load(INDEX_PATH)
+            await asyncio.to_thread(engine.load, INDEX_PATH)
         except:
             raise HTTPException(400, "No video indexed. Upload and index a video first.")
     
-    results = engine.search(query, top_k=top_k)
+    future = asyncio.get_running_loop().create_future()
+    await search_queue.put((query, top_k, nprobe, future))
+    results = await future
     return {
         "query": query,
         "results": results
     }
 
 
+@app.post("/search_batch")
+async def search_batch(request: SearchBatchRequest):
+    """Search many queries in one call (one encoder pass and one FAISS search)"""
+    if engine.index is None:
+        # Try loading saved index
+        try:
+            await asyncio.to_thread(engine.load, INDEX_PATH)
+        except:
+            raise HTTPException(400, "No video indexed. Upload and index a video first.")
+    if not request.queries:
+        return {"results": []}
+    
+    results = await asyncio.to_thread(engine.search_batch, request.queries, request.top_k, request.nprobe)
+    return {
+        "results": [
+            {"query": query, "results": query_results}
+            for query, query_results in zip(request.queries, results)
+        ]
+    }
+
+
 @app.get("/frame/{frame_index}")
 def get_frame(frame_index: int):
-    """Get a specific frame image"""
-    frame_path = os.path.join(FRAMES_DIR, f"frame_{frame_index:05d}.jpg")
-    if not os.path.exists(frame_path):
+    """Get a specific frame image, decoded from the indexed video on demand"""
+    if engine.index is None:
+        # Try loading saved index
+        try:
+            engine.load(INDEX_PATH)
+        except:
+            raise HTTPException(404, "Frame not found")
+    if not 0 <= frame_index < len(engine.ts_ms):
         raise HTTPException(404, "Frame not found")
-    return FileResponse(frame_path, media_type="image/jpeg")
+    
+    key = (engine.video_path, float(engine.ts_ms[frame_index]))
+    with frame_cache_lock:
+        jpeg = frame_cache.get(key)
+    if jpeg is None:
+        jpeg = engine.frame_jpeg(frame_index)
+        with frame_cache_lock:
+            frame_cache[key] = jpeg
+    return Response(content=jpeg, media_type="image/jpeg")
 
 
 @app.get("/video/{filename}")
@@ -0,0 +1,243 @@
+import asyncio
+import hashlib
+import importlib
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import video_search
+
+
+class StubEngine:
+    """Stands in for VideoSearchEngine so the server can be tested without CLIP or FAISS"""
+
+    max_top_k = 100  # larger top_k fails, like a FAISS index asked for too many neighbors
+
+    def __init__(self, *args, **kwargs):
+        self.index = None
+        self.video_path = None
+        self.ts_ms = np.empty(0, dtype=np.float64)
+        self.builds = 0
+        self.search_calls = []
+        self.frame_calls = []
+
+    def warmup(self):
+        pass
+
+    def build_index(self, video_path, fps=1, dedupe=True):
+        self.builds += 1
+        self.index = object()
+        self.video_path = video_path
+        self.ts_ms = np.arange(3, dtype=np.float64) * 1000
+
+    def save(self, path):
+        with open(f"{path}.json", "w") as f:
+            json.dump({'video_path': self.video_path, 'ts_ms': self.ts_ms.tolist(), 'builds': self.builds}, f)
+
+    def load(self, path):
+        with open(f"{path}.json") as f:
+            saved = json.load(f)
+        self.index = object()
+        self.video_path = saved['video_path']
+        self.ts_ms = np.array(saved['ts_ms'])
+        self.builds = saved['builds']
+        return self
+
+    def frame_jpeg(self, frame_index):
+        self.frame_calls.append(frame_index)
+        # Differs per build, like frames decoded from re-uploaded content
+        return f"{self.video_path}:{frame_index}:{self.builds}".encode()
+
+    def search_batch(self, queries, top_k=5, nprobe=None):
+        self.search_calls.append((list(queries), top_k, nprobe))
+        if top_k > self.max_top_k:
+            raise RuntimeError(f"k={top_k} too large")
+        return [[{'rank': r + 1, 'query': q} for r in range(top_k)] for q in queries]
+
+
+@pytest.fixture
+def server(monkeypatch, tmp_path):
+    """A freshly imported server module (empty caches and hashes) running in tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(video_search, 'VideoSearchEngine', StubEngine)
+    sys.modules.pop('server', None)
+    yield importlib.import_module('server')
+    sys.modules.pop('server', None)
+
+
+@pytest.fixture
+def client(server):
+    with TestClient(server.app) as client:
+        yield client
+
+
+def run_batcher(server, requests):
+    """Queue (query, top_k, nprobe) requests at once and collect each one's result or exception"""
+    async def scenario():
+        server.search_queue = asyncio.Queue()
+        batcher = asyncio.create_task(server.search_batcher())
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in requests]
+        for request, future in zip(requests, futures):
+            await server.search_queue.put((*request, future))
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        batcher.cancel()
+        return results
+    return asyncio.run(scenario())
+
+
+def test_batcher_coalesces_by_nprobe(server):
+    results = run_batcher(server, [('a', 1, None), ('b', 3, None), ('c', 2, 8)])
+    assert server.engine.search_calls == [(['a', 'b'], 3, None), (['c'], 2, 8)]
+    # Each caller gets its own query's results, trimmed to its own top_k
+    assert [[r['query'] for r in result] for result in results] == [['a'], ['b'] * 3, ['c'] * 2]
+
+
+def test_batcher_isolates_failing_request(server):
+    results = run_batcher(server, [('a', 2, None), ('b', 10**9, None), ('c', 1, None)])
+    assert len(results[0]) == 2 and results[0][0]['query'] == 'a'
+    assert isinstance(results[1], RuntimeError)
+    assert len(results[2]) == 1 and results[2][0]['query'] == 'c'
+
+
+def test_search(client, server):
+    server.engine.index = object()
+    response = client.get('/search', params={'query': 'cat', 'top_k': 2})
+    assert response.status_code == 200
+    assert response.json() == {'query': 'cat', 'results': [{'rank': 1, 'query': 'cat'}, {'rank': 2, 'query': 'cat'}]}
+
+
+@pytest.mark.parametrize('params', [{'top_k': 0}, {'top_k': 10**9}, {'nprobe': 0}])
+def test_search_rejects_out_of_range_params(client, server, params):
+    server.engine.index = object()
+    assert client.get('/search', params={'query': 'cat', **params}).status_code == 422
+    assert server.engine.search_calls == []
+
+
+def test_search_without_index(client):
+    assert client.get('/search', params={'query': 'cat'}).status_code == 400
+
+
+def put_video(name='clip.mp4', content=b'video'):
+    os.makedirs('uploads', exist_ok=True)
+    with open(os.path.join('uploads', name), 'wb') as f:
+        f.write(content)
+
+
+def test_frame_is_cached(client, server):
+    put_video()
+    assert client.post('/index', params={'filename': 'clip.mp4'}).status_code == 200
+    first = client.get('/frame/1')
+    assert first.status_code == 200
+    assert first.headers['content-type'] == 'image/jpeg'
+    assert client.get('/frame/1').content == first.content
+    assert server.engine.frame_calls == [1]
+    assert client.get('/frame/3').status_code == 404
+
+
+def test_reindex_clears_frame_cache(client, server):
+    put_video()
+    client.post('/index', params={'filename': 'clip.mp4'})
+    before = client.get('/frame/0').content
+    put_video(content=b'other video')
+    client.post('/index', params={'filename': 'clip.mp4'})
+    assert client.get('/frame/0').content != before
+    assert server.engine.frame_calls == [0, 0]
+
+
+def test_frame_loads_saved_index_after_restart(client, server):
+    put_video()
+    client.post('/index', params={'filename': 'clip.mp4'})
+    importlib.reload(server)  # fresh engine with no index, as after a restart
+    with TestClient(server.app) as restarted:
+        assert restarted.get('/frame/2').status_code == 200
+    assert server.engine.frame_calls == [2]
+
+
+def test_frame_without_index(client):
+    assert client.get('/frame/0').status_code == 404
+
+
+def upload(client, name='clip.mp4', content=b'video'):
+    return client.post('/upload', files={'file': (name, content, 'video/mp4')})
+
+
+def test_upload_streams_and_hashes(client):
+    response = upload(client, content=b'x' * 3_000_000)
+    assert response.status_code == 200
+    assert response.json()['hash'] == hashlib.blake2b(b'x' * 3_000_000).hexdigest()
+    with open(os.path.join('uploads', 'clip.mp4'), 'rb') as f:
+        assert f.read() == b'x' * 3_000_000
+
+
+def test_upload_rejects_non_video(client):
+    assert upload(client, name='notes.txt').status_code == 400
+
+
+def test_index_skips_identical_content(client, server):
+    upload(client)
+    assert client.post('/index', params={'filename': 'clip.mp4'}).json()['status'] == 'indexed'
+    assert client.post('/index', params={'filename': 'clip.mp4'}).json()['status'] == 'already_indexed'
+    # Same bytes under another name: reports the file the index was built from
+    upload(client, name='copy.mp4')
+    response = client.post('/index', params={'filename': 'copy.mp4'}).json()
+    assert response['status'] == 'already_indexed'
+    assert response['video'] == 'clip.mp4'
+    assert server.engine.builds == 1
+
+
+def test_index_rebuilds_for_new_settings_or_content(client, server):
+    upload(client)
+    client.post('/index', params={'filename': 'clip.mp4'})
+    assert client.post('/index', params={'filename': 'clip.mp4', 'fps': 2}).json()['status'] == 'indexed'
+    assert client.post('/index', params={'filename': 'clip.mp4', 'fps': 2, 'dedupe': False}).json()['status'] == 'indexed'
+    assert server.engine.builds == 3
+
+
+def test_reupload_of_indexed_file_resets_hash_and_previews(client, server):
+    upload(client)
+    client.post('/index', params={'filename': 'clip.mp4'})
+    before = client.get('/frame/0').content
+    upload(client, content=b'new video')
+    # Previews of the replaced file are gone before it is even re-indexed
+    client.get('/frame/0')
+    assert server.engine.frame_calls == [0, 0]
+    assert client.post('/index', params={'filename': 'clip.mp4'}).json()['status'] == 'indexed'
+    assert server.engine.builds == 2
+
+
+def test_search_batch(client, server):
+    server.engine.index = object()
+    response = client.post('/search_batch', json={'queries': ['a', 'b'], 'top_k': 2, 'nprobe': 4})
+    assert response.status_code == 200
+    assert [r['query'] for r in response.json()['results']] == ['a', 'b']
+    assert [len(r['results']) for r in response.json()['results']] == [2, 2]
+    # One engine call for the whole request, bypassing the micro-batcher
+    assert server.engine.search_calls == [(['a', 'b'], 2, 4)]
+
+
+def test_search_batch_empty(client, server):
+    server.engine.index = object()
+    assert client.post('/search_batch', json={'queries': []}).json() == {'results': []}
+    assert server.engine.search_calls == []
+
+
+@pytest.mark.parametrize('body', [
+    {'queries': ['a'], 'top_k': 0},
+    {'queries': ['a'], 'top_k': None},
+    {'queries': ['a'], 'top_k': 10**9},
+    {'queries': ['a'], 'nprobe': -1},
+    {'queries': ['a'] * 1025},  # over MAX_BATCH_QUERIES
+])
+def test_search_batch_rejects_invalid_requests(client, server, body):
+    server.engine.index = object()
+    assert client.post('/search_batch', json=body).status_code == 422
+    assert server.engine.search_calls == []
+
+
+def test_search_batch_without_index(client):
+    assert client.post('/search_batch', json={'queries': ['a']}).status_code == 400
@@ -0,0 +1,268 @@
+import json
+
+import cv2
+import faiss
+import numpy as np
+import pytest
+import torch
+
+import video_search
+from video_search import VideoSearchEngine, _phash, _phash_gpu, _resize_crop
+
+
+# Small enough that OPQ + IVF + PQ trains in seconds; same index path as a real FLAT_INDEX_MAX+ corpus
+IVF_TEST_SIZE = 2_000
+IVF_TEST_DIM = 64
+IVF_TEST_PQ_M = 8
+
+
+def make_engine(n=0, dim=512):
+    """Engine without a CLIP model; enough state for indexing, search and save/load"""
+    engine = VideoSearchEngine.__new__(VideoSearchEngine)
+    engine.device = 'cpu'
+    engine.gpu_res = None
+    engine.index = None
+    engine.embeddings = None
+    engine.embedding_dim = dim
+    engine.video_path = 'video.mp4'
+    engine.ts_ms = np.arange(n, dtype=np.float64) * 1000
+    return engine
+
+
+def random_embeddings(n, dim=512, seed=0):
+    x = np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+@pytest.fixture(scope='module')
+def ivf_engine():
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(video_search, 'FLAT_INDEX_MAX', IVF_TEST_SIZE)
+        mp.setattr(video_search, 'PQ_M', IVF_TEST_PQ_M)
+        engine = make_engine(IVF_TEST_SIZE, dim=IVF_TEST_DIM)
+        engine.index_embeddings(random_embeddings(IVF_TEST_SIZE, dim=IVF_TEST_DIM))
+    return engine
+
+
+@pytest.fixture(scope='module')
+def tiny_clip_engine(tmp_path_factory):
+    """Engine on a tiny randomly initialized CLIP, saved locally so no download is needed"""
+    transformers = pytest.importorskip('transformers')
+    path = tmp_path_factory.mktemp('tiny-clip')
+    vocab = {token: i for i, token in enumerate(['a', 'b', 'a</w>', 'b</w>', '<|startoftext|>', '<|endoftext|>'])}
+    (path / 'vocab.json').write_text(json.dumps(vocab))
+    (path / 'merges.txt').write_text('#version: 0.2\n')
+    tokenizer = transformers.CLIPTokenizer(str(path / 'vocab.json'), str(path / 'merges.txt'))
+    transformers.CLIPProcessor(image_processor=transformers.CLIPImageProcessorPil(), tokenizer=tokenizer).save_pretrained(path)
+    tiny = dict(hidden_size=32, intermediate_size=37, num_hidden_layers=2, num_attention_heads=2)
+    config = transformers.CLIPConfig(
+        text_config=dict(tiny, vocab_size=len(vocab), bos_token_id=4, eos_token_id=5, pad_token_id=5),
+        vision_config=dict(tiny, image_size=video_search.CLIP_SIZE, patch_size=32),
+        projection_dim=512,  # the engine indexes 512-d ViT-B-32 embeddings
+    )
+    torch.manual_seed(0)
+    transformers.CLIPModel(config).save_pretrained(path)
+    return VideoSearchEngine(str(path), compile_vision=False)
+
+
+def random_frame(h, w, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (h, w, 3), dtype=np.uint8)
+
+
+def brighten(frame, amount=10):
+    return np.clip(frame.astype(np.int16) + amount, 0, 255).astype(np.uint8)
+
+
+def hamming(a, b):
+    return bin((int(a) ^ int(b)) & (2**64 - 1)).count('1')
+
+
+@pytest.mark.parametrize('shape', [(480, 640), (640, 480), (100, 150), (224, 224)])
+def test_resize_crop_shape(shape):
+    out = _resize_crop(random_frame(*shape))
+    assert out.shape == (224, 224, 3)
+    assert out.dtype == np.uint8
+    assert out.flags['C_CONTIGUOUS']
+
+
+def test_resize_crop_keeps_center():
+    frame = np.zeros((480, 960, 3), dtype=np.uint8)
+    frame[:, 240:720] = 255  # the centered square survives the crop
+    assert _resize_crop(frame)[:, 2:-2].min() == 255
+
+
+def test_phash_stable_and_discriminative():
+    frame = random_frame(360, 640)
+    assert _phash(frame) == _phash(frame.copy())
+    assert hamming(_phash(frame), _phash(brighten(frame))) <= video_search.PHASH_MAX_DISTANCE
+    assert hamming(_phash(frame), _phash(random_frame(360, 640, seed=1))) > video_search.PHASH_MAX_DISTANCE
+
+
+def test_phash_gpu_stable_and_discriminative():
+    frames = np.stack([random_frame(224, 224), random_frame(224, 224, seed=1)])
+    hashes = _phash_gpu(torch.from_numpy(frames))
+    assert hashes.dtype == np.uint64
+    assert np.array_equal(hashes, _phash_gpu(torch.from_numpy(frames.copy())))
+    near = _phash_gpu(torch.from_numpy(brighten(frames)))
+    assert hamming(hashes[0], near[0]) <= video_search.PHASH_MAX_DISTANCE
+    assert hamming(hashes[0], hashes[1]) > video_search.PHASH_MAX_DISTANCE
+
+
+def test_dedupe_mask():
+    hashes = np.array([0b0, 0b1, 0b111111, 0b111110, 0b0], dtype=np.int64)
+    keep, last = VideoSearchEngine._dedupe_mask(hashes, None)
+    assert keep.tolist() == [True, False, True, False, True]
+    assert last == 0
+
+
+def test_dedupe_mask_carries_last_hash():
+    keep, last = VideoSearchEngine._dedupe_mask(np.array([0b11], dtype=np.int64), 0b1)
+    assert keep.tolist() == [False]
+    assert last == 0b1
+    keep, _ = VideoSearchEngine._dedupe_mask(np.array([], dtype=np.int64), None)
+    assert keep.tolist() == []
+
+
+def test_format_results_drops_padding():
+    engine = make_engine(3)
+    scores = np.array([0.9, 0.5, -np.inf], dtype=np.float32)
+    indices = np.array([2, 0, -1])
+    results = engine._format_results(scores, indices)
+    assert results == [
+        {'rank': 1, 'score': pytest.approx(0.9), 'timestamp_sec': 2.0, 'timestamp_ms': 2000.0, 'frame_index': 2},
+        {'rank': 2, 'score': pytest.approx(0.5), 'timestamp_sec': 0.0, 'timestamp_ms': 0.0, 'frame_index': 0},
+    ]
+
+
+def test_ivf_index_above_flat_max(ivf_engine):
+    assert isinstance(ivf_engine.index, faiss.IndexPreTransform)
+    assert ivf_engine.embeddings.dtype == np.float16
+    assert ivf_engine.embeddings.shape == (IVF_TEST_SIZE, IVF_TEST_DIM)
+
+
+def test_search_rerank_exact_scores(ivf_engine):
+    queries = ivf_engine.embeddings[[7, 1234]].astype(np.float32)
+    scores, indices = ivf_engine._search_rerank(queries, top_k=5)
+    assert indices[:, 0].tolist() == [7, 1234]
+    # Scores are exact inner products against the stored vectors, sorted descending
+    expected = np.einsum('qkd,qd->qk', ivf_engine.embeddings[indices].astype(np.float32), queries)
+    np.testing.assert_allclose(scores, expected, rtol=1e-5)
+    assert (np.diff(scores, axis=1) <= 0).all()
+
+
+def test_search_rerank_pads_short_results(ivf_engine):
+    queries = ivf_engine.embeddings[:1].astype(np.float32)
+    # One probed list holds far fewer than IVF_TEST_SIZE vectors
+    scores, indices = ivf_engine._search_rerank(queries, top_k=IVF_TEST_SIZE, nprobe=1)
+    valid = indices[0] >= 0
+    assert 0 < valid.sum() < IVF_TEST_SIZE
+    assert valid[:valid.sum()].all()
+    assert np.isneginf(scores[0][~valid]).all()
+
+
+@pytest.fixture
+def ivf_copy(ivf_engine):
+    """Private copy of ivf_engine for tests that save it (saving moves its inverted lists to disk)"""
+    engine = make_engine(IVF_TEST_SIZE, dim=IVF_TEST_DIM)
+    engine.index = faiss.clone_index(ivf_engine.index)
+    engine.embeddings = ivf_engine.embeddings.copy()
+    return engine
+
+
+def test_save_over_loaded_embeddings(tmp_path, ivf_copy):
+    path = str(tmp_path / 'idx')
+    ivf_copy.save(path)
+    loaded = make_engine(dim=IVF_TEST_DIM).load(path)
+    assert isinstance(loaded.embeddings, np.memmap)
+    # The memmap reads from the very file this save writes
+    loaded.save(path)
+    reloaded = make_engine(dim=IVF_TEST_DIM).load(path)
+    np.testing.assert_array_equal(reloaded.embeddings, ivf_copy.embeddings)
+
+
+@pytest.mark.parametrize('bgr', [True, False])
+def test_create_embeddings_matches_sentence_transformers(tiny_clip_engine, bgr):
+    Image = pytest.importorskip('PIL.Image')
+    frames = np.stack([random_frame(224, 224, seed=s) for s in range(3)])
+    embeddings = tiny_clip_engine.create_embeddings(torch.from_numpy(frames), bgr=bgr)
+    # Reference: SentenceTransformer's own image preprocessing on the same RGB pixels
+    images = [Image.fromarray(np.ascontiguousarray(f[..., ::-1] if bgr else f)) for f in frames]
+    expected = tiny_clip_engine.model.encode(images, normalize_embeddings=True)
+    assert embeddings.dtype == np.float32
+    np.testing.assert_allclose(embeddings, expected, atol=1e-3 if tiny_clip_engine.device == 'cuda' else 1e-5)
+
+
+def test_build_index_falls_back_from_cpu_only_decord(tmp_path, tiny_clip_engine, monkeypatch):
+    if video_search.decord is None:
+        pytest.skip('decord not installed')
+    path = str(tmp_path / 'clip.mp4')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 10, (320, 240))
+    for i in range(30):
+        writer.write(random_frame(240, 320, seed=i))
+    writer.release()
+    # PyPI decord has no CUDA, so opening a GPU reader fails and indexing must use the DataLoader path
+    monkeypatch.setattr(tiny_clip_engine, '_nvdec', True)
+    tiny_clip_engine.build_index(path, fps=1)
+    assert tiny_clip_engine._nvdec is False
+    assert tiny_clip_engine.index.ntotal == 3
+    np.testing.assert_allclose(tiny_clip_engine.ts_ms, [0, 1000, 2000])
+
+
+def test_save_load_flat(tmp_path):
+    embeddings = random_embeddings(100)
+    engine = make_engine(100)
+    engine.ts_ms = np.sort(np.random.default_rng(0).uniform(0, 1e6, 100))
+    engine.index_embeddings(embeddings)
+    assert engine.embeddings is None
+    path = str(tmp_path / 'idx')
+    engine.save(path)
+    assert (tmp_path / 'idx_metadata.parquet').exists()
+    assert not (tmp_path / 'idx_emb.fp16').exists()
+    assert not (tmp_path / 'idx_index.ivfdata').exists()
+
+    loaded = make_engine().load(path)
+    assert loaded.video_path == 'video.mp4'
+    assert loaded.ts_ms.dtype == np.float64
+    np.testing.assert_array_equal(loaded.ts_ms, engine.ts_ms)
+    assert loaded.embeddings is None
+    _, indices = loaded.index.search(embeddings[[3, 50]], 1)
+    assert indices[:, 0].tolist() == [3, 50]
+
+
+@pytest.mark.parametrize('top_k, nprobe', [(0, None), (5, 0)])
+def test_search_batch_validates_before_encoding(top_k, nprobe):
+    engine = make_engine(3)
+    engine.index = faiss.IndexFlatIP(engine.embedding_dim)
+    with pytest.raises(ValueError):
+        engine.search_batch(['a'], top_k=top_k, nprobe=nprobe)
+
+
+def test_save_load_ivf(tmp_path, ivf_copy):
+    queries = ivf_copy.embeddings[[1, 1500]].astype(np.float32)
+    before = ivf_copy._search_rerank(queries, top_k=5)
+    path = str(tmp_path / 'idx')
+    ivf_copy.save(path)
+    assert (tmp_path / 'idx_index.ivfdata').exists()
+    # Saving again to the same path reuses the on-disk lists
+    ivf_copy.save(path)
+
+    loaded = make_engine(dim=IVF_TEST_DIM).load(path)
+    np.testing.assert_array_equal(loaded.ts_ms, ivf_copy.ts_ms)
+    assert isinstance(loaded.embeddings, np.memmap)
+    after = loaded._search_rerank(queries, top_k=5)
+    np.testing.assert_array_equal(before[1], after[1])
+    np.testing.assert_array_equal(before[0], after[0])
+    assert after[1][:, 0].tolist() == [1, 1500]
+
+
+def test_resave_loaded_ivf_from_relative_path(tmp_path, ivf_copy, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    queries = ivf_copy.embeddings[[1, 1500]].astype(np.float32)
+    before = ivf_copy._search_rerank(queries, top_k=5)
+    ivf_copy.save('idx')
+    loaded = make_engine(dim=IVF_TEST_DIM).load('idx')
+    # The loaded lists are memory-mapped from idx_index.ivfdata, the file this save targets
+    loaded.save('idx')
+    after = make_engine(dim=IVF_TEST_DIM).load('idx')._search_rerank(queries, top_k=5)
+    np.testing.assert_array_equal(before[1], after[1])
+    np.testing.assert_array_equal(before[0], after[0])
@@ -4,128 +4,526 @@ Extracts frames, creates embeddings, stores in FAISS, enables text-to-video sear
 """
 
 import os
+import math
+import threading
+import av
 import cv2
 import numpy as np
-from PIL import Image
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader, Dataset
 from sentence_transformers import SentenceTransformer, util
+import pyarrow as pa
+import pyarrow.parquet as pq
 import faiss
-import pickle
-from pathlib import Path
+import faiss.contrib.torch_utils  # lets GPU indexes search CUDA tensors in place
+from collections import OrderedDict
+
+try:
+    import decord  # optional: NVDEC hardware decoding on CUDA hosts
+    decord.bridge.set_bridge('torch')
+except ImportError:
+    decord = None
+
+# Below this many frames an exact flat index is fast enough; above it, use OPQ+IVFPQ
+FLAT_INDEX_MAX = 10_000
+PQ_M = 64  # PQ sub-quantizers (64 bytes per vector at 8 bits each)
+NPROBE = 32
+RERANK_K = 256  # PQ candidates re-scored exactly against the original embeddings
+ENCODE_BATCH = 128
+NVDEC_CHUNK = 32  # frames decoded per NVDEC call; full-resolution frames are large on the GPU
+LOADER_WORKERS = min(8, os.cpu_count() or 1)
+# A seek decodes forward from the previous keyframe, so it only pays off for jumps longer
+# than a typical GOP (x264's default keyint is 250); shorter gaps are grabbed through
+SEEK_MIN_FRAMES = 300
+CLIP_SIZE = 224
+QUERY_CACHE_SIZE = 1024
+QUERY_ENCODE_BATCH = 256  # caps text-encoder activations for large /search_batch requests
+JPEG_QUALITY = 85
+PHASH_SIZE = 32  # frames are shrunk to 32x32 grayscale; the low-frequency 8x8 DCT block forms the hash
+PHASH_MAX_DISTANCE = 5  # frames within this Hamming distance of the last kept frame are dropped
+
+
+def _resize_crop(frame: np.ndarray) -> np.ndarray:
+    """Resize so the short side is CLIP_SIZE, then center crop to a square; channel order is untouched"""
+    h, w = frame.shape[:2]
+    scale = CLIP_SIZE / min(h, w)
+    size = (max(CLIP_SIZE, round(w * scale)), max(CLIP_SIZE, round(h * scale)))
+    frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC)
+    top, left = (size[1] - CLIP_SIZE) // 2, (size[0] - CLIP_SIZE) // 2
+    return np.ascontiguousarray(frame[top:top + CLIP_SIZE, left:left + CLIP_SIZE])
+
+
+def _phash(frame: np.ndarray) -> int:
+    """64-bit perceptual hash of a BGR frame: low-frequency DCT coefficients thresholded at their median"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (PHASH_SIZE, PHASH_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    # Signed so the default collate can batch it; callers reinterpret as uint64
+    return int(np.packbits(low > np.median(low)).view('>i8')[0])
+
+
+def _phash_gpu(frames: torch.Tensor) -> np.ndarray:
+    """Perceptual hashes of a (N, H, W, 3) uint8 RGB batch on the GPU; returns uint64 hashes
+    
+    Same construction as _phash, but in float math without cv2's uint8 rounding, so hashes
+    are not bit-identical to _phash. Dedupe only compares hashes from one decode path.
+    """
+    luma = torch.tensor([0.299, 0.587, 0.114], device=frames.device)
+    gray = (frames.float() @ luma).unsqueeze(1)
+    small = F.interpolate(gray, size=(PHASH_SIZE, PHASH_SIZE), mode='area')[:, 0]
+    k = torch.arange(PHASH_SIZE, device=frames.device, dtype=torch.float32)
+    dct = torch.cos(math.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * PHASH_SIZE))  # unnormalized DCT-II basis
+    low = (dct @ small @ dct.T)[:, :8, :8].reshape(len(frames), 64)
+    # quantile(0.5) averages the two middle values, like np.median in _phash
+    bits = (low > torch.quantile(low, 0.5, dim=1, keepdim=True)).cpu().numpy()
+    return np.packbits(bits, axis=1).view('>u8')[:, 0].astype(np.uint64)
+
+
+class FrameDataset(Dataset):
+    """Sampled video frames, decoded, resized and center-cropped inside DataLoader workers
+    
+    Frames stay uint8 BGR; color swap and normalization happen in one pass at encode time.
+    """
+    
+    def __init__(self, video_path: str, frame_interval: int, num_frames: int):
+        self.video_path = video_path
+        self.frame_interval = frame_interval
+        self.num_frames = num_frames
+        self.cap = None  # opened lazily so each worker process gets its own decoder
+    
+    def __len__(self):
+        return self.num_frames
+    
+    def __getitem__(self, i: int):
+        """Returns (frame, timestamp_ms, phash, ok); ok is False past the real end of the video"""
+        if self.cap is None:
+            self.cap = cv2.VideoCapture(self.video_path)
+        
+        target = i * self.frame_interval
+        position = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+        if target < position or target - position > SEEK_MIN_FRAMES:
+            # Backward or long jump (e.g. the start of this worker's next batch)
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+        else:
+            for _ in range(target - position):
+                if not self.cap.grab():
+                    break
+        ret, frame = self.cap.read()
+        if not ret:
+            return np.zeros((CLIP_SIZE, CLIP_SIZE, 3), dtype=np.uint8), -1.0, 0, False
+        
+        timestamp_ms = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+        frame = _resize_crop(frame)
+        return frame, timestamp_ms, _phash(frame), True
+
 
 class VideoSearchEngine:
-    def __init__(self, model_name='clip-ViT-B-32'):
+    def __init__(self, model_name='clip-ViT-B-32', compile_vision: bool = True):
+        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        # Fixed OpenMP pool for CPU search so latency doesn't depend on the host's core count
+        faiss.omp_set_num_threads(min(8, os.cpu_count() or 1))
+        self.model_name = model_name
         self.model = SentenceTransformer(model_name)
+        if self.device == 'cuda':
+            self.model = self.model.to('cuda').half()
+        image_processor = self.model[0].processor.image_processor
+        # CLIP mean/std folded into one subtract-multiply over raw 0-255 pixels
+        self._pixel_mean = torch.tensor(image_processor.image_mean, device=self.device).view(1, 3, 1, 1) * 255
+        self._pixel_inv_std = 1 / (torch.tensor(image_processor.image_std, device=self.device).view(1, 3, 1, 1) * 255)
+        self._nvdec = self.device == 'cuda' and decord is not None
+        self._encode_pixels = self._encode_pixels_eager
+        self._vision_compiled = compile_vision and self.device == 'cuda'
+        if self._vision_compiled:
+            # Normalization + vision tower as one compiled CUDA graph, specialized to the indexer's batch shape
+            self._encode_pixels = torch.compile(self._encode_pixels, mode='reduce-overhead', fullgraph=True)
+            with torch.inference_mode():
+                self._encode_pixels(
+                    torch.zeros(ENCODE_BATCH, CLIP_SIZE, CLIP_SIZE, 3, device='cuda', dtype=torch.uint8),
+                    bgr=not self._nvdec
+                )
         self.index = None
-        self.frame_data = []  # stores {timestamp, frame_path}
+        self.gpu_res = None
+        self.video_path = None  # source of frames served by frame_jpeg()
+        self.ts_ms = np.empty(0, dtype=np.float64)  # frame timestamps; row i is frame_index i
+        self.embeddings = None  # normalized FP16 vectors, kept only for IVFPQ rerank
         self.embedding_dim = 512
+        # LRU of query -> embedding; per-instance so it is tied to this engine's model
+        self._query_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
         
-    def extract_frames(self, video_path: str, output_dir: str, fps: int = 1) -> list:
-        """Extract frames from video at specified FPS"""
-        Path(output_dir).mkdir(parents=True, exist_ok=True)
-        
+    def _to_gpu(self, index):
+        """Move a flat index onto the GPU when CUDA and a GPU build of FAISS are available"""
+        if self.device != 'cuda' or not hasattr(faiss, 'StandardGpuResources') or faiss.get_num_gpus() == 0:
+            return index
+        if not isinstance(index, faiss.IndexFlat):
+            return index
+        if self.gpu_res is None:
+            self.gpu_res = faiss.StandardGpuResources()
+        return faiss.index_cpu_to_gpu(self.gpu_res, 0, index)
+    
+    def _index_on_gpu(self) -> bool:
+        return hasattr(faiss, 'GpuIndex') and isinstance(self.index, faiss.GpuIndex)
+    
+    @staticmethod
+    def _sample_plan(video_path: str, fps: int) -> tuple:
+        """Returns (frame_interval, number of sampled frames) for a video"""
         cap = cv2.VideoCapture(video_path)
-        video_fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_interval = int(video_fps / fps)
-        
-        frames = []
-        frame_count = 0
-        saved_count = 0VS
-        
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-                
-            if frame_count % frame_interval == 0:
-                timestamp_ms = cap.get(cv2.CAP_PROP_POS_MSEC)
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                frame_path = os.path.join(output_dir, f"frame_{saved_count:05d}.jpg")
-                cv2.imwrite(frame_path, frame)
-                
-                frames.append({
-                    'timestamp_ms': timestamp_ms,
-                    'timestamp_sec': timestamp_ms / 1000,
-                    'frame_path': frame_path,
-                    'frame_index': saved_count
-                })
-                saved_count += 1
-                
-            frame_count += 1
-            
-        cap.release()
-        print(f"Extracted {len(frames)} frames from {video_path}")
-        return frames
-    
-    def create_embeddings(self, frames: list) -> np.ndarray:
-        """Create CLIP embeddings for extracted frames"""
-        images = []
-        for f in frames:
-            img = Image.open(f['frame_path'])
-            images.append(img)
-        
-        print(f"Creating embeddings for {len(images)} frames...")
-        embeddings = self.model.encode(images, convert_to_numpy=True, show_progress_bar=True)
-        return embeddings.astype('float32')
-    
-    def build_index(self, video_path: str, output_dir: str = "frames", fps: int = 1):
-        """Full pipeline: extract frames, embed, build FAISS index"""
-        # Extract frames
-        self.frame_data = self.extract_frames(video_path, output_dir, fps)
-        
-        # Create embeddings
-        embeddings = self.create_embeddings(self.frame_data)
-        
-        # Build FAISS index
-        self.index = faiss.IndexFlatIP(self.embedding_dim)  # Inner product for cosine sim
-        faiss.normalize_L2(embeddings)  # Normalize for cosine similarity
-        self.index.add(embeddings)
+        try:
+            if not cap.isOpened():
+                raise IOError(f"Could not open video: {video_path}")
+            video_fps = cap.get(cv2.CAP_PROP_FPS)
+            frame_interval = max(int(video_fps / fps), 1)
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            if total_frames <= 0:
+                # Frame count unknown (e.g. some streams): count by grabbing, without retrieving frames
+                total_frames = 0
+                while cap.grab():
+                    total_frames += 1
+        finally:
+            cap.release()
+        return frame_interval, (total_frames + frame_interval - 1) // frame_interval
+    
+    def _encode_pixels_eager(self, frames: torch.Tensor, bgr: bool) -> torch.Tensor:
+        """(N, 224, 224, 3) uint8 frames -> L2-normalized CLIP image embeddings"""
+        x = frames.permute(0, 3, 1, 2)
+        if bgr:
+            x = x.flip(1)
+        x = ((x.float() - self._pixel_mean) * self._pixel_inv_std).to(self.model[0].model.dtype)
+        features = self.model[0].model.get_image_features(pixel_values=x)
+        if not isinstance(features, torch.Tensor):
+            features = features.pooler_output  # transformers >= 5 wraps the projected embeddings in a model output
+        return F.normalize(features, dim=-1)
+    
+    def create_embeddings(self, frames: torch.Tensor, bgr: bool = True) -> np.ndarray:
+        """Create L2-normalized CLIP embeddings for a batch of resized, cropped uint8 frames
         
-        print(f"Built index with {self.index.ntotal} vectors")
+        Calls the vision tower directly, bypassing SentenceTransformer's per-image loop.
+        Frames are uploaded as uint8 and only widened on the device.
+        """
+        n = len(frames)
+        if self._vision_compiled and n < ENCODE_BATCH:
+            # Pad the tail batch so the compiled graph never sees a new shape
+            frames = torch.cat([frames, frames.new_zeros((ENCODE_BATCH - n, *frames.shape[1:]))])
+        with torch.inference_mode():
+            frames = frames.to(self.device, non_blocking=True)
+            embeddings = self._encode_pixels(frames, bgr=bgr)[:n]
+        return embeddings.float().cpu().numpy()
+    
+    def _frame_batches(self, video_path: str, fps: int):
+        """Yield (frames, timestamps_ms, phashes) batches of resized, cropped uint8 BGR frames
+        
+        DataLoader workers seek, decode and resize frames in parallel on the CPU.
+        """
+        frame_interval, num_frames = self._sample_plan(video_path, fps)
+        dataset = FrameDataset(video_path, frame_interval, num_frames)
+        loader = DataLoader(
+            dataset, batch_size=ENCODE_BATCH, num_workers=LOADER_WORKERS, pin_memory=self.device == 'cuda'
+        )
+        for frames, timestamp_ms, phash, ok in loader:
+            if not ok.all():
+                frames, timestamp_ms, phash = frames[ok], timestamp_ms[ok], phash[ok]
+            if len(frames):
+                yield frames, timestamp_ms.tolist(), phash.numpy().view(np.uint64)
+    
+    def _open_nvdec(self, video_path: str):
+        """decord reader on the GPU for video_path, or None if this decord build has no CUDA
+        
+        PyPI decord wheels are built without CUDA; after the first such failure the
+        engine stays on the CPU DataLoader path.
+        """
+        try:
+            return decord.VideoReader(video_path, ctx=decord.gpu(0))
+        except decord.DECORDError as e:
+            print(f"NVDEC decode unavailable, falling back to CPU decode: {e}")
+            self._nvdec = False
+            return None
+    
+    def _frame_batches_nvdec(self, vr, fps: int):
+        """Same as _frame_batches, but decoded by NVDEC and resized on the GPU; frames are RGB
+        
+        Frames never leave the device between decode and the vision tower.
+        """
+        frame_interval = max(int(vr.get_avg_fps() / fps), 1)
+        indices = list(range(0, len(vr), frame_interval))
+        timestamps = (vr.get_frame_timestamp(indices)[:, 0] * 1000).tolist()
+        
+        for start in range(0, len(indices), ENCODE_BATCH):
+            batch = indices[start:start + ENCODE_BATCH]
+            frames = torch.cat([
+                self._resize_crop_gpu(vr.get_batch(batch[i:i + NVDEC_CHUNK]))
+                for i in range(0, len(batch), NVDEC_CHUNK)
+            ])
+            yield frames, timestamps[start:start + ENCODE_BATCH], _phash_gpu(frames)
+    
+    @staticmethod
+    def _resize_crop_gpu(frames: torch.Tensor) -> torch.Tensor:
+        """_resize_crop for a (N, H, W, 3) uint8 batch on the GPU"""
+        x = frames.permute(0, 3, 1, 2).float()
+        h, w = x.shape[-2:]
+        scale = CLIP_SIZE / min(h, w)
+        size = (max(CLIP_SIZE, round(h * scale)), max(CLIP_SIZE, round(w * scale)))
+        x = F.interpolate(x, size=size, mode='bicubic', antialias=True, align_corners=False)
+        top, left = (size[0] - CLIP_SIZE) // 2, (size[1] - CLIP_SIZE) // 2
+        x = x[:, :, top:top + CLIP_SIZE, left:left + CLIP_SIZE]
+        return x.clamp(0, 255).round().to(torch.uint8).permute(0, 2, 3, 1)
+    
+    @staticmethod
+    def _dedupe_mask(phashes: np.ndarray, last_hash):
+        """Keep a frame only if its pHash differs enough from the last kept frame's"""
+        keep = np.ones(len(phashes), dtype=bool)
+        for i, h in enumerate(phashes.tolist()):
+            if last_hash is not None and (h ^ last_hash).bit_count() <= PHASH_MAX_DISTANCE:
+                keep[i] = False
+            else:
+                last_hash = h
+        return keep, last_hash
+    
+    def build_index(self, video_path: str, fps: int = 1, dedupe: bool = True):
+        """Full pipeline: extract frames, embed, build FAISS index
+        
+        Frames come from NVDEC when a CUDA build of decord is available, otherwise from
+        parallel CPU DataLoader workers. With dedupe, near-identical consecutive
+        frames (by perceptual hash) are dropped before CLIP sees them. Frames are
+        not written to disk; frame_jpeg() decodes them on demand.
+        """
+        vr = self._open_nvdec(video_path) if self._nvdec else None
+        if vr is not None:
+            batches = self._frame_batches_nvdec(vr, fps)
+        else:
+            batches = self._frame_batches(video_path, fps)
+        
+        timestamps = []
+        chunks = []
+        last_hash = None
+        for frames, timestamp_ms, phashes in batches:
+            if dedupe:
+                keep, last_hash = self._dedupe_mask(phashes, last_hash)
+                if not keep.any():
+                    continue
+                frames = frames[torch.from_numpy(keep).to(frames.device)]
+                timestamp_ms = [t for t, k in zip(timestamp_ms, keep) if k]
+            timestamps.extend(timestamp_ms)
+            chunks.append(self.create_embeddings(frames, bgr=vr is None))
+        if not timestamps:
+            raise ValueError(f"No frames extracted from {video_path}")
+        
+        print(f"Extracted and embedded {len(timestamps)} frames from {video_path}")
+        self.video_path = video_path
+        self.ts_ms = np.asarray(timestamps, dtype=np.float64)
+        self.index_embeddings(np.concatenate(chunks))
         return self
     
-    def search(self, query: str, top_k: int = 5) -> list:
+    def index_embeddings(self, embeddings: np.ndarray):
+        """Build the FAISS index over L2-normalized (N, dim) FP32 embeddings"""
+        n = len(embeddings)
+        if n < FLAT_INDEX_MAX:
+            self.index = faiss.IndexFlatIP(self.embedding_dim)  # Inner product for cosine sim
+            self.embeddings = None
+            self.index.add(embeddings)
+            self.index = self._to_gpu(self.index)
+        else:
+            nlist = int(4 * np.sqrt(n))
+            self.index = faiss.index_factory(
+                self.embedding_dim, f"OPQ{PQ_M},IVF{nlist},PQ{PQ_M}", faiss.METRIC_INNER_PRODUCT
+            )
+            self.index.train(embeddings)
+            faiss.extract_index_ivf(self.index).nprobe = NPROBE
+            self.embeddings = embeddings.astype(np.float16)
+            self.index.add(embeddings)
+        
+        print(f"Built index with {self.index.ntotal} vectors")
+    
+    def _encode_text(self, queries: list) -> torch.Tensor:
+        """Normalized (n, dim) FP32 query embeddings, left on the model's device"""
+        with torch.inference_mode():
+            return self.model.encode(
+                queries, batch_size=min(len(queries), QUERY_ENCODE_BATCH), convert_to_tensor=True,
+                normalize_embeddings=True, show_progress_bar=False
+            ).float()
+    
+    def _encode_queries(self, queries: list) -> torch.Tensor:
+        """Embed queries through the LRU cache; all misses share one encoder forward pass"""
+        found = {}
+        with self._query_cache_lock:
+            for q in queries:
+                if q in self._query_cache:
+                    self._query_cache.move_to_end(q)
+                    found[q] = self._query_cache[q]
+        
+        misses = list(dict.fromkeys(q for q in queries if q not in found))
+        if misses:
+            encoded = self._encode_text(misses)
+            with self._query_cache_lock:
+                for q, emb in zip(misses, encoded):
+                    found[q] = self._query_cache[q] = emb
+                while len(self._query_cache) > QUERY_CACHE_SIZE:
+                    self._query_cache.popitem(last=False)
+        
+        return torch.stack([found[q] for q in queries]).contiguous()
+    
+    def warmup(self):
+        """Run one text encode so CUDA init and kernel selection happen before the first request"""
+        self._encode_text(["warmup"])
+    
+    def search(self, query: str, top_k: int = 5, nprobe: int = None) -> list:
         """Search video frames using natural language query"""
+        return self.search_batch([query], top_k, nprobe)[0]
+    
+    def search_batch(self, queries: list, top_k: int = 5, nprobe: int = None) -> list:
+        """Search several queries at once; returns one result list per query
+        
+        nprobe overrides the number of IVF lists visited (default NPROBE); it has
+        no effect on flat indexes.
+        """
         if self.index is None:
             raise ValueError("Index not built. Call build_index() first.")
+        if top_k < 1 or (nprobe is not None and nprobe < 1):
+            raise ValueError("top_k and nprobe must be >= 1")
         
-        # Encode query
-        query_embedding = self.model.encode([query], convert_to_numpy=True).astype('float32')
-        faiss.normalize_L2(query_embedding)
+        # Encode queries
+        query_embeddings = self._encode_queries(queries)
         
         # Search
-        scores, indices = self.index.search(query_embedding, top_k)
-        
-        results = []
-        for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-            if idx < len(self.frame_data):
-                result = {
-                    'rank': i + 1,
-                    'score': float(score),
-                    'timestamp_sec': self.frame_data[idx]['timestamp_sec'],
-                    'timestamp_ms': self.frame_data[idx]['timestamp_ms'],
-                    'frame_path': self.frame_data[idx]['frame_path'],
-                    'frame_index': self.frame_data[idx]['frame_index']
-                }
-                results.append(result)
-        
-        return results
+        if self.embeddings is not None:
+            scores, indices = self._search_rerank(
+                np.ascontiguousarray(query_embeddings.cpu().numpy()), top_k, nprobe or NPROBE
+            )
+        elif self._index_on_gpu():
+            # Queries stay on the device; FAISS reads the tensor's CUDA pointer directly
+            scores, indices = self.index.search(query_embeddings, top_k)
+            scores, indices = scores.cpu().numpy(), indices.cpu().numpy()
+        else:
+            # One (nq, dim) x (dim, N) GEMM for the whole batch; FAISS needs C-contiguous input for it
+            scores, indices = self.index.search(np.ascontiguousarray(query_embeddings.cpu().numpy()), top_k)
+        
+        return [self._format_results(s, idx) for s, idx in zip(scores, indices)]
+    
+    def _format_results(self, scores: np.ndarray, indices: np.ndarray) -> list:
+        valid = (indices >= 0) & (indices < len(self.ts_ms))  # FAISS pads short results with -1
+        scores, indices = scores[valid], indices[valid]
+        ts = self.ts_ms[indices]
+        return [
+            {
+                'rank': i + 1,
+                'score': float(scores[i]),
+                'timestamp_sec': float(ts[i]) / 1000,
+                'timestamp_ms': float(ts[i]),
+                'frame_index': int(indices[i])
+            }
+            for i in range(len(indices))
+        ]
+    
+    def _ivf_params(self, nprobe: int):
+        """Per-call IVF search parameters, so concurrent searches never share nprobe through the index"""
+        params = faiss.SearchParametersIVF(nprobe=nprobe)
+        if isinstance(self.index, faiss.IndexPreTransform):
+            params = faiss.SearchParametersPreTransform(index_params=params)
+        return params
+    
+    def _search_rerank(self, query_embeddings: np.ndarray, top_k: int, nprobe: int = NPROBE):
+        """Take top RERANK_K candidates per query from the PQ index, re-score them exactly"""
+        # search_numpy: torch_utils' search replacement doesn't accept params
+        _, cands = self.index.search_numpy(query_embeddings, max(top_k, RERANK_K), params=self._ivf_params(nprobe))
+        scores = np.full((len(cands), top_k), -np.inf, dtype='float32')
+        indices = np.full((len(cands), top_k), -1, dtype='int64')
+        for qi, cand in enumerate(cands):
+            cand = cand[cand >= 0]
+            # Only the candidate rows are widened to FP32
+            exact = self.embeddings[cand].astype(np.float32) @ query_embeddings[qi]
+            order = np.argsort(-exact)[:top_k]
+            scores[qi, :len(order)] = exact[order]
+            indices[qi, :len(order)] = cand[order]
+        return scores, indices
+    
+    def frame_jpeg(self, frame_index: int, quality: int = JPEG_QUALITY) -> bytes:
+        """Decode one indexed frame from the source video and return it as JPEG bytes"""
+        if not 0 <= frame_index < len(self.ts_ms):
+            raise IndexError(f"Frame {frame_index} not in index")
+        timestamp_ms = self.ts_ms[frame_index]
+        
+        with av.open(self.video_path) as container:
+            stream = container.streams.video[0]
+            start = stream.start_time or 0
+            # Seek to the keyframe before the target, then decode forward to it
+            container.seek(start + int(timestamp_ms / 1000 / stream.time_base), stream=stream)
+            for frame in container.decode(stream):
+                if frame.pts is not None and (frame.pts - start) * stream.time_base * 1000 >= timestamp_ms - 1:
+                    break
+            else:
+                raise ValueError(f"Could not decode frame {frame_index} from {self.video_path}")
+            image = frame.to_ndarray(format='bgr24')
+        
+        ok, jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            raise ValueError(f"Could not encode frame {frame_index}")
+        return jpeg.tobytes()
     
     def save(self, path: str):
         """Save index and frame data to disk"""
-        data = {
-            'frame_data': self.frame_data,
-        }
-        with open(f"{path}_metadata.pkl", 'wb') as f:
-            pickle.dump(data, f)
-        faiss.write_index(self.index, f"{path}_index.faiss")
+        table = pa.Table.from_pydict({'ts_ms': self.ts_ms})
+        table = table.replace_schema_metadata({'video_path': self.video_path})
+        pq.write_table(table, f"{path}_metadata.parquet", compression='zstd')
+        ivfdata_path = f"{path}_index.ivfdata"
+        if self.embeddings is not None:
+            self._write_ondisk_ivf(path)
+        else:
+            index = faiss.index_gpu_to_cpu(self.index) if self._index_on_gpu() else self.index
+            faiss.write_index(index, f"{path}_index.faiss")
+            if os.path.exists(ivfdata_path):
+                os.remove(ivfdata_path)
+        emb_path = f"{path}_emb.fp16"
+        if self.embeddings is not None:
+            # After load() the embeddings are a memmap of this very file; rewriting it would truncate it first
+            loaded_from = getattr(self.embeddings, 'filename', None)
+            if not (loaded_from and os.path.exists(emb_path) and os.path.samefile(loaded_from, emb_path)):
+                self.embeddings.tofile(emb_path)
+        elif os.path.exists(emb_path):
+            os.remove(emb_path)
         print(f"Saved index to {path}")
     
+    def _write_ondisk_ivf(self, path: str):
+        """Write an IVF index with its inverted lists in a separate <path>_index.ivfdata file
+        
+        The in-memory lists are merged into OnDiskInvertedLists, which then replace them
+        on the live index (freeing the RAM copy), so load() can memory-map the lists and
+        only page in the ones a query visits.
+        """
+        ivfdata_path = f"{path}_index.ivfdata"
+        index_ivf = faiss.extract_index_ivf(self.index)
+        current = faiss.downcast_InvertedLists(index_ivf.invlists)
+        # After load() the lists may already be mapped from this file (under a path spelled differently,
+        # e.g. "./idx_index.ivfdata"); rebuilding it in place would clobber the lists being read
+        already_on_disk = (
+            isinstance(current, faiss.OnDiskInvertedLists) and os.path.exists(ivfdata_path)
+            and os.path.samefile(current.filename, ivfdata_path)
+        )
+        if not already_on_disk:
+            invlists = faiss.OnDiskInvertedLists(index_ivf.nlist, index_ivf.code_size, ivfdata_path)
+            sources = faiss.InvertedListsPtrVector()
+            sources.push_back(index_ivf.invlists)
+            invlists.merge_from_multiple(sources.data(), sources.size())
+            index_ivf.replace_invlists(invlists, True)
+            invlists.this.disown()  # owned by the index now
+        faiss.write_index(self.index, f"{path}_index.faiss")
+    
     def load(self, path: str):
         """Load index and frame data from disk"""
-        with open(f"{path}_metadata.pkl", 'rb') as f:
-            data = pickle.load(f)
-        self.frame_data = data['frame_data']
-        self.index = faiss.read_index(f"{path}_index.faiss")
+        table = pq.read_table(f"{path}_metadata.parquet", memory_map=True)
+        self.video_path = table.schema.metadata[b'video_path'].decode()
+        self.ts_ms = table.column('ts_ms').to_numpy()
+        if os.path.exists(f"{path}_index.ivfdata"):
+            # Inverted lists stay on disk and are memory-mapped; resident memory scales with nprobe, not N
+            self.index = faiss.read_index(
+                f"{path}_index.faiss", faiss.IO_FLAG_ONDISK_SAME_DIR | faiss.IO_FLAG_READ_ONLY
+            )
+        else:
+            self.index = self._to_gpu(faiss.read_index(f"{path}_index.faiss"))
+        emb_path = f"{path}_emb.fp16"
+        if os.path.exists(emb_path):
+            self.embeddings = np.memmap(emb_path, dtype=np.float16, mode='r').reshape(-1, self.embedding_dim)
+        else:
+            self.embeddings = None
         print(f"Loaded index with {self.index.ntotal} vectors")
         return self
 
@@ -7,7 +7,6 @@ interface SearchResult {
   score: number;
   timestamp_sec: number;
   timestamp_ms: number;
-  frame_path: string;
   frame_index: number;
 }
 